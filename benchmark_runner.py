@@ -6,15 +6,19 @@ Benchmark Runner for Project Singularity
 - Measures CPU and RAM deltas across run
 - Logs size, throughput, and system metrics to benchmark_log.txt
 - Graceful receiver shutdown
+- Optional WAN emulation: `--wan PROFILE` puts wan_proxy.py between
+  sender and receiver (see wan_proxy.WAN_PROFILES)
 """
 
-import subprocess, time, sys, psutil, datetime, os, signal
+import subprocess, time, sys, psutil, datetime, os, signal, argparse
 from pathlib import Path
+import config
 
 # --- Paths ---
 BASE_DIR  = Path(__file__).parent
 RECEIVER  = BASE_DIR / "snglty_recv.py"
 SENDER    = BASE_DIR / "sndr_snglty.py"
+PROXY     = BASE_DIR / "wan_proxy.py"
 FILE_PATH = BASE_DIR / "thorn_massive.log"
 LOG_PATH  = BASE_DIR / "benchmark_log.txt"
 
@@ -26,91 +30,124 @@ def ensure_log_header():
             f.write("Timestamp | Duration | CPU Δ | RAM Δ | FileSize | Throughput\n")
 
 
-def run_benchmark():
-    print("[RUNNER] Launching receiver...")
-
-    rx_log = open("receiver_stdout.log", "w")
-    rx = subprocess.Popen(
-        [sys.executable, str(RECEIVER)],
+def launch_until_ready(cmd, tag, log, env=None):
+    """Start a helper process and block until it prints `tag`. Returns None on failure."""
+    p = subprocess.Popen(
+        cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
-        bufsize=1
+        bufsize=1,
+        env=env,
     )
-
-    # --- Wait for readiness ---
-    ready = False
     while True:
-        line = rx.stdout.readline()
+        line = p.stdout.readline()
         if not line:
             break
-        rx_log.write(line)
-        rx_log.flush()
-        if "[RX_READY]" in line:
-            ready = True
-            break
+        log.write(line)
+        log.flush()
+        if tag in line:
+            return p
+    try:
+        p.terminate()
+    except Exception:
+        pass
+    return None
 
-    if not ready:
-        print("[RUNNER] Receiver failed to signal readiness. See receiver_stdout.log")
-        try:
-            rx.terminate()
-        except Exception:
-            pass
-        return
-
-    print("[RUNNER] Launching sender...")
-
-    # --- System metrics before ---
-    proc = psutil.Process()
-    cpu_before = psutil.cpu_percent(interval=None)
-    mem_before = proc.memory_info().rss / 1_048_576  # MB
-
-    # --- Run sender ---
-    t0 = time.perf_counter()
-    with open("sender_stdout.log", "w") as tx_log:
-        subprocess.run(
-            [sys.executable, str(SENDER)],
-            stdout=tx_log,
-            stderr=subprocess.STDOUT,
-            check=True,
-        )
-    t1 = time.perf_counter()
-    elapsed = t1 - t0
-
-    # --- System metrics after ---
-    cpu_after = psutil.cpu_percent(interval=None)
-    mem_after = proc.memory_info().rss / 1_048_576  # MB
-    cpu_delta = cpu_after - cpu_before
-    mem_delta = mem_after - mem_before
-
-    print(f"[RESULT] Duration: {elapsed:.2f}s")
-
-    # --- File stats ---
-    file_size = os.path.getsize(FILE_PATH)
-    gb_total = file_size / 1e9
-    gbps = (file_size * 8 / 1e9) / elapsed if elapsed > 0 else 0.0
-
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    ensure_log_header()
-    with open(LOG_PATH, "a") as log:
-        log.write(
-            f"{timestamp} | {elapsed:.2f}s | {cpu_delta:.1f}% | {mem_delta:.1f} MB | "
-            f"{gb_total:.2f} GB | {gbps:.2f} Gbps\n"
-        )
-
-    # --- Cleanup receiver ---
+
+def stop(p):
     try:
-        rx.terminate()
-        rx.wait(timeout=3)
+        p.terminate()
+        p.wait(timeout=3)
     except Exception:
         try:
-            rx.kill()
+            p.kill()
         except Exception:
             pass
+
+
+def run_benchmark(wan_profile=None):
+    print("[RUNNER] Launching receiver...")
+
+    # Behind the proxy the receiver moves to RECV_PORT + offset
+    rx_env = dict(os.environ)
+    if wan_profile:
+        rx_env["SGLTY_RECV_PORT_OFFSET"] = str(config.WAN_PROXY_PORT_OFFSET)
+
+    rx_log = open("receiver_stdout.log", "w")
+    rx, proxy, proxy_log = None, None, None
+    try:
+        rx = launch_until_ready([sys.executable, str(RECEIVER)], "[RX_READY]", rx_log, env=rx_env)
+        if rx is None:
+            print("[RUNNER] Receiver failed to signal readiness. See receiver_stdout.log")
+            return
+
+        if wan_profile:
+            print(f"[RUNNER] Launching WAN proxy (profile: {wan_profile})...")
+            proxy_log = open("proxy_stdout.log", "w")
+            proxy = launch_until_ready(
+                [sys.executable, str(PROXY), "--profile", wan_profile,
+                 "--offset", str(config.WAN_PROXY_PORT_OFFSET)],
+                "[PROXY_READY]", proxy_log,
+            )
+            if proxy is None:
+                print("[RUNNER] WAN proxy failed to signal readiness. See proxy_stdout.log")
+                return
+
+        print("[RUNNER] Launching sender...")
+
+        # --- System metrics before ---
+        proc = psutil.Process()
+        cpu_before = psutil.cpu_percent(interval=None)
+        mem_before = proc.memory_info().rss / 1_048_576  # MB
+
+        # --- Run sender ---
+        t0 = time.perf_counter()
+        with open("sender_stdout.log", "w") as tx_log:
+            subprocess.run(
+                [sys.executable, str(SENDER)],
+                stdout=tx_log,
+                stderr=subprocess.STDOUT,
+                check=True,
+            )
+        t1 = time.perf_counter()
+        elapsed = t1 - t0
+
+        # --- System metrics after ---
+        cpu_after = psutil.cpu_percent(interval=None)
+        mem_after = proc.memory_info().rss / 1_048_576  # MB
+        cpu_delta = cpu_after - cpu_before
+        mem_delta = mem_after - mem_before
+
+        print(f"[RESULT] Duration: {elapsed:.2f}s")
+
+        # --- File stats ---
+        file_size = os.path.getsize(FILE_PATH)
+        gb_total = file_size / 1e9
+        gbps = (file_size * 8 / 1e9) / elapsed if elapsed > 0 else 0.0
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        ensure_log_header()
+        with open(LOG_PATH, "a") as log:
+            log.write(
+                f"{timestamp} | {elapsed:.2f}s | {cpu_delta:.1f}% | {mem_delta:.1f} MB | "
+                f"{gb_total:.2f} GB | {gbps:.2f} Gbps"
+                + (f" | wan:{wan_profile}" if wan_profile else "")
+                + "\n"
+            )
     finally:
-        rx_log.close()
+        # --- Cleanup proxy + receiver (also when the sender fails) ---
+        for p in (proxy, rx):
+            if p:
+                stop(p)
+        for f in (proxy_log, rx_log):
+            if f:
+                f.close()
 
 
 if __name__ == "__main__":
-    run_benchmark()
+    ap = argparse.ArgumentParser(description="Project Singularity benchmark runner")
+    ap.add_argument("--wan", metavar="PROFILE", help="run through wan_proxy.py with this impairment profile")
+    args = ap.parse_args()
+    run_benchmark(wan_profile=args.wan)
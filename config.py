@@ -2,6 +2,8 @@
 config.py — Singularity Engine Core Configuration
 """
 
+import os
+
 # Target file to send
 TEST_FILE = "thorn_massive.log"
 
@@ -10,14 +12,31 @@ SEND_PORTS = [9001, 9002, 9003, 9004, 9005, 9006]
 RECV_PORT  = [9001, 9002, 9003, 9004, 9005, 9006]
 HOST_IP    = "127.0.0.1"
 
+# WAN emulation (wan_proxy.py): the proxy takes over SEND_PORTS and the
+# receiver moves to RECV_PORT + offset. benchmark_runner.py sets the env var.
+WAN_PROXY_PORT_OFFSET = 100
+RECV_PORT_OFFSET = int(os.environ.get("SGLTY_RECV_PORT_OFFSET", "0"))
+
 # Sharding Parameters
 SHARD_SIZE_BYTES  = 4 * 1024 * 1024     # 4 MiB per shard
 HEADER_SIZE_BYTES = 64                  # Fixed header size from shrdng_snglrty.py
 FRAME_LEN_BYTES   = 4                   # Optional framing length (legacy streams)
 
+# Sparse / zero-region elision: all-zero shards and filesystem holes are sent
+# as header-only frames and left as holes on the receiver
+ELIDE_ZERO_SHARDS = True
+
 # Sender batching / flow control
 DRAIN_BATCH_BYTES = 16 * 1024 * 1024    # Flush every 16 MiB per lane
 
+# Fan-out replication: one read + hash of TEST_FILE feeds every destination.
+# Entries are (host, [lane ports]); (HOST_IP, SEND_PORTS) is always the first.
+#   "star":  the sender streams to every destination concurrently
+#   "chain": the sender feeds the first; each receiver forwards to the next
+FANOUT_DESTINATIONS = []
+FANOUT_MODE = "star"
+FANOUT_BUFFER_BYTES = 256 * 1024 * 1024  # max lag of a destination (or hop) behind the fastest
+
 # Identifiers
 MAGIC_TAG = "SLGTY"
 VERSION    = 1
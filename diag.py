@@ -1,44 +1,345 @@
-import psutil
+"""
+diag.py — Singularity host diagnostic + capacity probe
+Reports listeners, load and related processes, then measures in-process
+the real ceilings of this host:
+  - loopback TCP throughput vs. lane count (engine-style framing + drain)
+  - sequential read throughput of the source volume (page cache dropped)
+  - xxh128 hashing throughput on one core (what the sender loop uses)
+  - header pack/unpack rate
+and prints the predicted bottleneck and a recommended configuration.
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
 import socket
+import struct
+import sys
+import tempfile
 import time
-import os
-import subprocess
 
-print("\n=== Singularity Diagnostic ===")
+import psutil
+import xxhash
+
+import config
+from shrdng_snglrty import pack_header, unpack_header, HEADER_SIZE
+from utils_net import tune_socket
+
+LEN_FMT = "!I"
+LANE_COUNTS = [1, 2, 4, 6, 8, 12]
+SHARD_SIZES_MB = [1, 2, 4, 8, 16]
+MiB = 1024 * 1024
+
+
+# ===============================================================
+# Host snapshot
+# ===============================================================
+
+def show_listeners(ports):
+    print(f"\n[1] Active TCP listeners on {config.HOST_IP} {min(ports)}–{max(ports)}:")
+    try:
+        conns = psutil.net_connections(kind="tcp")
+    except psutil.AccessDenied:
+        print("unavailable (needs elevated privileges on this platform)")
+        return
+    found = [c for c in conns
+             if c.status == psutil.CONN_LISTEN and c.laddr and c.laddr.port in ports]
+    for c in found:
+        print(f"{c.laddr.ip}:{c.laddr.port}  PID {c.pid or '?'}")
+    if not found:
+        print("none")
+
+
+def show_load():
+    print("\n[2] System CPU & memory load:")
+    print(f"CPU: {psutil.cpu_percent(interval=1):.1f}%  |  RAM used: {psutil.virtual_memory().percent:.1f}%")
+
+
+def show_processes():
+    print("\n[3] Python processes related to Singularity:")
+    for p in psutil.process_iter(['pid', 'name', 'cmdline']):
+        try:
+            if 'python' in p.name() and any('snglty' in s for s in p.info['cmdline'] or []):
+                cpu = p.cpu_percent(interval=0.1)
+                mem = p.memory_info().rss / 1_048_576
+                print(f"PID {p.pid:>7}  CPU {cpu:>4.1f}%  MEM {mem:>6.1f} MB  CMD {' '.join(p.info['cmdline'])}")
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
 
-# 1. Check for bound receiver ports
-print("\n[1] Active TCP listeners on localhost 9000–9010:")
-subprocess.run("sudo lsof -i :9000-9010 | grep LISTEN || echo 'none'", shell=True)
 
-# 2. CPU + memory snapshot
-print("\n[2] System CPU & memory load:")
-print(f"CPU: {psutil.cpu_percent(interval=1):.1f}%  |  RAM used: {psutil.virtual_memory().percent:.1f}%")
+def _sysctl(name: str):
+    try:
+        with open(f"/proc/sys/{name.replace('.', '/')}") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError):
+        return None
+
+
+def show_socket_buffers():
+    """Report what the kernel actually grants for the configured buffers."""
+    print("\n[4] Socket buffers:")
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    default_snd = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    tune_socket(s, config.SO_SNDBUF, config.SO_RCVBUF)
+    snd = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    rcv = s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    s.close()
+    if sys.platform.startswith("linux"):
+        snd, rcv = snd // 2, rcv // 2  # Linux reports 2x (bookkeeping overhead)
+    wmem_max, rmem_max = _sysctl("net.core.wmem_max"), _sysctl("net.core.rmem_max")
+    print(f"Default SO_SNDBUF: {default_snd/1024:.1f} KiB")
+    print(f"Requested SO_SNDBUF/SO_RCVBUF: {config.SO_SNDBUF/MiB:.1f}/{config.SO_RCVBUF/MiB:.1f} MiB  "
+          f"→ granted {snd/MiB:.1f}/{rcv/MiB:.1f} MiB")
+    if wmem_max is not None:
+        print(f"Kernel caps wmem_max/rmem_max: {wmem_max/MiB:.1f}/{(rmem_max or 0)/MiB:.1f} MiB")
+    return wmem_max, rmem_max
+
+
+# ===============================================================
+# Capacity probes
+# ===============================================================
+
+def _sink_process(conn):
+    """Receiver side of the TCP probe: accept lanes, read and discard."""
+    async def handle(reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock:
+            tune_socket(sock, config.SO_SNDBUF, config.SO_RCVBUF)
+        while await reader.read(MiB):
+            pass
+        writer.close()
+
+    async def serve():
+        srv = await asyncio.start_server(handle, host=config.HOST_IP, port=0)
+        conn.send(srv.sockets[0].getsockname()[1])
+        await srv.serve_forever()
+
+    asyncio.run(serve())
 
-# 3. Python processes related to Singularity
-print("\n[3] Python processes related to Singularity:")
-for p in psutil.process_iter(['pid', 'name', 'cmdline']):
+
+async def _tcp_run(port: int, lanes: int, shard_size: int, seconds: float) -> float:
+    """Drive `lanes` connections like send_on_lane for `seconds`; return bytes/s delivered."""
+    payload = pack_header(session_id=0, shard_index=0, total_shards=0, offset=0,
+                          data_length=shard_size, hash=b"\x00" * 16) + os.urandom(shard_size)
+    prefix = struct.pack(LEN_FMT, len(payload))
+    deadline = time.perf_counter() + seconds
+
+    async def lane() -> int:
+        reader, writer = await asyncio.open_connection(config.HOST_IP, port)
+        sock = writer.get_extra_info("socket")
+        if sock:
+            tune_socket(sock, config.SO_SNDBUF, config.SO_RCVBUF)
+        sent = pending = 0
+        while time.perf_counter() < deadline:
+            writer.write(prefix)
+            writer.write(payload)
+            pending += len(payload)
+            sent += len(payload)
+            if pending >= config.DRAIN_BATCH_BYTES:
+                await writer.drain()
+                pending = 0
+        writer.write_eof()
+        await writer.drain()
+        await reader.read()  # sink closes after EOF → everything was delivered
+        writer.close()
+        return sent
+
+    t0 = time.perf_counter()
+    total = sum(await asyncio.gather(*(lane() for _ in range(lanes))))
+    return total / (time.perf_counter() - t0)
+
+
+def probe_tcp(seconds: float, shard_size: int, shard_sizes):
+    """
+    Loopback TCP throughput per lane count at `shard_size`, then per shard
+    size at the recommended lane count. The receiver runs in its own process.
+    """
+    parent, child = mp.Pipe()
+    sink = mp.Process(target=_sink_process, args=(child,), daemon=True)
+    sink.start()
     try:
-        if 'python' in p.name() and any('snglty' in s for s in p.info['cmdline']):
-            cpu = p.cpu_percent(interval=0.1)
-            mem = p.memory_info().rss / 1_048_576
-            print(f"PID {p.pid:>7}  CPU {cpu:>4.1f}%  MEM {mem:>6.1f} MB  CMD {' '.join(p.info['cmdline'])}")
-    except (psutil.NoSuchProcess, psutil.AccessDenied):
-        pass
-
-# 4. Socket buffer test
-print("\n[4] Socket buffer test (localhost):")
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind(("127.0.0.1", 0))
-s.listen(1)
-buf = s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
-print(f"Default SO_SNDBUF: {buf/1024:.1f} KiB")
-s.close()
-
-# 5. Loopback throughput sanity check
-print("\n[5] Loopback throughput test (1GiB zero-copy)")
-t0 = time.perf_counter()
-os.system("dd if=/dev/zero of=/dev/null bs=1M count=1024 2>/dev/null")
-t1 = time.perf_counter()
-print(f"Raw memcpy test (1GiB zero-copy): {(1/(t1-t0)):.2f} GiB/s")
-
-print("\n=== End diagnostics ===\n")
+        port = parent.recv()
+        results = {n: asyncio.run(_tcp_run(port, n, shard_size, seconds)) for n in LANE_COUNTS}
+        shard_rates = {}
+        best_lanes = recommend_lanes(results)
+        for size in shard_sizes:
+            shard_rates[size] = asyncio.run(_tcp_run(port, best_lanes, size, seconds / 2))
+        return results, shard_rates
+    finally:
+        sink.terminate()
+        sink.join()
+
+
+def _drop_cache(fd: int) -> None:
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def probe_disk(path: str, seconds: float, shard_size: int):
+    """
+    Sequential read throughput (bytes/s) of `path`. A directory, or a file
+    too small to time, is measured through a scratch file on the same volume.
+    The rate is None when the volume cannot be read or written.
+    """
+    scratch = None
+    try:
+        if os.path.isdir(path) or not os.path.exists(path) or os.path.getsize(path) < 64 * MiB:
+            directory = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+            fd, scratch = tempfile.mkstemp(prefix=".sgl_probe_", dir=directory)
+            block = os.urandom(shard_size)
+            with os.fdopen(fd, "wb") as f:
+                for _ in range(256 * MiB // shard_size):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            path = scratch
+
+        buf = bytearray(shard_size)
+        done = 0
+        with open(path, "rb", buffering=0) as f:
+            _drop_cache(f.fileno())
+            deadline = time.perf_counter() + seconds
+            t0 = time.perf_counter()
+            while time.perf_counter() < deadline:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                done += n
+            elapsed = time.perf_counter() - t0
+            _drop_cache(f.fileno())
+        return path, done / elapsed if elapsed > 0 else 0.0
+    except OSError as e:
+        return f"{path}: {e.strerror or e}", None
+    finally:
+        if scratch:
+            try:
+                os.unlink(scratch)
+            except OSError:
+                pass
+
+
+def probe_hash(seconds: float, shard_size: int) -> float:
+    """xxh128 throughput (bytes/s) on one core at `shard_size` chunks."""
+    block = os.urandom(shard_size)
+    done = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while time.perf_counter() < deadline:
+        xxhash.xxh128(block).digest()
+        done += shard_size
+    return done / (time.perf_counter() - t0)
+
+
+def probe_headers(seconds: float) -> float:
+    """pack_header + unpack_header round-trips per second."""
+    ops = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    h = b"\x00" * 16
+    while time.perf_counter() < deadline:
+        for i in range(1000):
+            unpack_header(pack_header(session_id=1, shard_index=i, total_shards=1000,
+                                      offset=i, data_length=HEADER_SIZE, hash=h))
+        ops += 1000
+    return ops / (time.perf_counter() - t0)
+
+
+# ===============================================================
+# Analysis
+# ===============================================================
+
+def recommend_lanes(tcp: dict) -> int:
+    """Fewest lanes reaching 95% of the best measured throughput."""
+    best = max(tcp.values())
+    return min(n for n, r in tcp.items() if r >= 0.95 * best)
+
+
+def serial_rate(*rates: float) -> float:
+    """The sender reads, hashes and writes on one loop thread: stage times add."""
+    return 1.0 / sum(1.0 / r for r in rates if r)
+
+
+def fmt(rate: float) -> str:
+    return f"{rate/1e9:6.2f} GB/s ({rate*8/1e9:6.2f} Gbps)"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Singularity diagnostic + capacity probe")
+    ap.add_argument("--seconds", type=float, default=0.5, help="duration of each probe step")
+    ap.add_argument("--source", default=config.TEST_FILE, help="file (or volume) the sender reads")
+    ap.add_argument("--rtt-ms", type=float, default=50.0, help="target path RTT for buffer sizing")
+    ap.add_argument("--no-probe", action="store_true", help="snapshot only, skip capacity probes")
+    args = ap.parse_args()
+
+    print("\n=== Singularity Diagnostic ===")
+    ports = sorted(set(config.SEND_PORTS) | set(config.RECV_PORT))
+    show_listeners(ports)
+    show_load()
+    show_processes()
+    wmem_max, rmem_max = show_socket_buffers()
+
+    if args.no_probe:
+        print("\n=== End diagnostics ===\n")
+        return
+
+    shard = config.SHARD_SIZE_BYTES
+    shard_sizes = sorted({mb * MiB for mb in SHARD_SIZES_MB} | {shard})
+    print(f"\n[5] Capacity probe ({args.seconds:.2f}s per step, {os.cpu_count()} CPUs):")
+
+    tcp, tcp_by_shard = probe_tcp(args.seconds, shard, shard_sizes)
+    for n, r in tcp.items():
+        print(f"  TCP loopback {n:>2} lane(s)      : {fmt(r)}")
+    lanes = recommend_lanes(tcp)
+    tcp_best = tcp[lanes]
+
+    src, disk = probe_disk(args.source, args.seconds * 2, shard)
+    print(f"  Disk sequential read        : {fmt(disk) if disk else 'unavailable'}  [{src}]")
+
+    hash_by_shard = {size: probe_hash(args.seconds / 2, size) for size in shard_sizes}
+    hash_rate = hash_by_shard[shard]
+    print(f"  xxh128 per core             : {fmt(hash_rate)}")
+
+    hdr = probe_headers(args.seconds)
+    print(f"  Header pack+unpack          : {hdr/1e6:6.2f} M/s  (≈ {fmt(hdr * shard)} at {shard//MiB} MiB shards)")
+
+    # --- Predicted bottleneck (at the configured shard size) ---
+    # An unmeasured disk (None) is left out of the bottleneck and serial sums
+    stages = {
+        "disk read": disk,
+        "xxh128 hashing": hash_rate,
+        "header pack/unpack": hdr * shard,
+        f"TCP ({lanes} lanes)": tcp_best,
+    }
+    stages = {k: v for k, v in stages.items() if v}
+    bottleneck = min(stages, key=stages.get)
+    predicted = serial_rate(disk, hash_rate, tcp_best)
+    print("\n[6] Prediction:")
+    print(f"  Bottleneck stage            : {bottleneck} at {fmt(stages[bottleneck])}")
+    print(f"  Predicted end-to-end        : {fmt(predicted)}  "
+          f"({'read + ' if disk else ''}hash + send serialised on the sender loop)")
+
+    # --- Recommendations ---
+    best_shard = max(
+        tcp_by_shard,
+        key=lambda s: serial_rate(disk, hash_by_shard[s], tcp_by_shard[s]),
+    )
+    per_lane = tcp_best / lanes
+    bdp = int(per_lane * args.rtt_ms / 1e3)
+    sock_buf = max(4 * MiB, 1 << (max(bdp, 1) - 1).bit_length())
+    print("\n[7] Recommended configuration:")
+    print(f"  SHARD_SIZE_BYTES  = {best_shard/MiB:g} * 1024 * 1024")
+    print(f"  SEND_PORTS        = {lanes} lanes (e.g. {[9001 + i for i in range(lanes)]})")
+    print(f"  SO_SNDBUF/RCVBUF  = {sock_buf//MiB} * 1024 * 1024   "
+          f"(per-lane BDP at {args.rtt_ms:.0f} ms RTT ≈ {bdp/MiB:.1f} MiB)")
+    if wmem_max is not None and (sock_buf > wmem_max or sock_buf > (rmem_max or 0)):
+        print(f"  ! Kernel caps buffers below this; raise net.core.wmem_max/rmem_max to ≥ {sock_buf}")
+
+    print("\n=== End diagnostics ===\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,19 @@ shrdng_snglrty.py
 ========================
 Transport-agnostic sharding helpers for Project Singularity.
 Adds per-shard header construction (64 bytes) and xxHash integrity.
+All-zero shards (and filesystem holes) are elided: they travel as a
+header-only frame flagged FLAG_ZERO and the receiver leaves them as holes.
 """
 
+import errno
+import json
 import os
 import struct
 import uuid
 import xxhash
 from dataclasses import dataclass
-from typing import Generator, List
+from functools import lru_cache
+from typing import Generator, List, Sequence, Tuple
 
 # ===============================================================
 # Header definition (64 bytes total)
@@ -35,6 +40,10 @@ MAGIC = b"SLGTY"
 VERSION = 1
 FLAGS_DEFAULT = 0
 
+# Flag bits
+FLAG_ZERO = 0x01  # shard range is all zeros; no payload follows the header
+FLAG_ROUTE = 0x02  # control frame: payload lists the chain hops still to feed
+
 
 def pack_header(**fields) -> bytes:
     """Serialize header fields into a 64-byte binary block."""
@@ -80,6 +89,38 @@ def unpack_header(data: bytes) -> dict:
     }
 
 
+# ===============================================================
+# Chain-replication route frames
+# ===============================================================
+
+Hop = Tuple[str, List[int]]  # (host, lane ports)
+
+
+def pack_route(lane: int, lanes: int, hops: Sequence[Hop]) -> bytes:
+    """
+    Build a [HEADER][JSON] control frame telling a receiver where to forward
+    `lane`. `lanes` is how many lanes feed each hop: every chain hop receives
+    one connection per lane the sender opened, whatever its own port count.
+    """
+    payload = json.dumps({"lane": lane, "lanes": lanes,
+                          "hops": [[h, list(p)] for h, p in hops]}).encode()
+    return pack_header(
+        flags=FLAG_ROUTE,
+        session_id=0,
+        shard_index=0,
+        total_shards=0,
+        offset=0,
+        data_length=len(payload),
+        hash=xxhash.xxh128(payload).digest(),
+    ) + payload
+
+
+def unpack_route(payload: bytes) -> Tuple[int, int, List[Hop]]:
+    """Inverse of pack_route's payload: (lane index, incoming lanes, remaining hops)."""
+    route = json.loads(payload)
+    return route["lane"], route["lanes"], [(h, list(p)) for h, p in route["hops"]]
+
+
 # ===============================================================
 # Shard class + helpers
 # ===============================================================
@@ -91,15 +132,26 @@ class Shard:
     data: bytes
     hash: bytes  # 16-byte binary hash
     header: bytes = b""
+    flags: int = FLAGS_DEFAULT
+    length: int = -1  # bytes of file covered; defaults to len(data)
+
+    def __post_init__(self) -> None:
+        if self.length < 0:
+            self.length = len(self.data)
+
+    @property
+    def is_zero(self) -> bool:
+        return bool(self.flags & FLAG_ZERO)
 
     def build_header(self, session_id: int, total_shards: int) -> None:
         """Construct and store binary header for this shard."""
         self.header = pack_header(
+            flags=self.flags,
             session_id=session_id,
             shard_index=self.index,
             total_shards=total_shards,
             offset=self.offset,
-            data_length=len(self.data),
+            data_length=self.length,
             hash=self.hash,
         )
 
@@ -108,33 +160,115 @@ class Shard:
         return self.header + self.data
 
 
+# ===============================================================
+# Zero / hole detection
+# ===============================================================
+
+@lru_cache(maxsize=8)
+def _zero_block(length: int) -> bytes:
+    """Shared all-zero buffer used for cheap `chunk == zeros` comparisons."""
+    return bytes(length)
+
+
+@lru_cache(maxsize=8)
+def _zero_hash(length: int) -> bytes:
+    """xxh128 of `length` zero bytes, computed once per distinct length."""
+    return xxhash.xxh128(_zero_block(length)).digest()
+
+
+def _is_zero(chunk: bytes) -> bool:
+    return chunk == _zero_block(len(chunk))
+
+
+def _zero_shard(index: int, offset: int, length: int) -> Shard:
+    return Shard(
+        index=index,
+        offset=offset,
+        data=b"",
+        hash=_zero_hash(length),
+        flags=FLAG_ZERO,
+        length=length,
+    )
+
+
+def _data_extent(fd: int, offset: int, size: int) -> Tuple[int, int]:
+    """
+    Return the next data extent [start, end) at or after `offset` via
+    SEEK_DATA/SEEK_HOLE; (size, size) when the rest of the file is a hole.
+    Raises OSError if the filesystem does not support hole probing.
+    """
+    try:
+        start = os.lseek(fd, offset, os.SEEK_DATA)
+    except OSError as e:
+        if e.errno == errno.ENXIO:  # no data past offset
+            return size, size
+        raise
+    return start, os.lseek(fd, start, os.SEEK_HOLE)
+
+
+def _read_at(f, offset: int, length: int) -> bytes:
+    """Positional read; independent of the file offset SEEK_DATA/SEEK_HOLE move."""
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), length, offset)
+    f.seek(offset)
+    return f.read(length)
+
+
 # ===============================================================
 # Sharding logic
 # ===============================================================
 
-def shard_file(file_path: str, shard_size: int) -> Generator[Shard, None, None]:
-    """Yield Shard objects from file, ready to transmit."""
+def shard_file(file_path: str, shard_size: int,
+               elide_zeros: bool = True) -> Generator[Shard, None, None]:
+    """
+    Yield Shard objects from file, ready to transmit.
+
+    With `elide_zeros`, shards lying entirely inside a hole are emitted
+    without touching the disk, and read shards that turn out all-zero are
+    emitted header-only (FLAG_ZERO) instead of carrying their payload.
+    """
     session_id = uuid.uuid4().int >> 64  # 64-bit session ID
     size = os.path.getsize(file_path)
     total = (size + shard_size - 1) // shard_size
+    probe_holes = elide_zeros and hasattr(os, "SEEK_DATA")
 
     with open(file_path, "rb") as f:
+        fd = f.fileno()
+        # Current data extent; [offset, data_start) is a hole. Probed again
+        # only once reading passes data_end.
+        data_start, data_end = 0, 0 if probe_holes else size
         idx, offset = 0, 0
-        while True:
-            chunk = f.read(shard_size)
-            if not chunk:
-                break
+        while offset < size:
+            length = min(shard_size, size - offset)
+
+            if probe_holes and offset >= data_end:
+                try:
+                    data_start, data_end = _data_extent(fd, offset, size)
+                except OSError:
+                    probe_holes = False  # filesystem can't tell us; read everything
+                    data_start, data_end = 0, size
+
+            if probe_holes and offset + length <= data_start:
+                s = _zero_shard(idx, offset, length)
+            else:
+                chunk = _read_at(f, offset, length)
+                if not chunk:
+                    break
+                length = len(chunk)
+                if elide_zeros and _is_zero(chunk):
+                    s = _zero_shard(idx, offset, length)
+                else:
+                    shard_hash = xxhash.xxh128(chunk).digest()
+                    s = Shard(index=idx, offset=offset, data=chunk, hash=shard_hash)
 
-            shard_hash = xxhash.xxh128(chunk).digest()
-            s = Shard(index=idx, offset=offset, data=chunk, hash=shard_hash)
             s.build_header(session_id, total)
             yield s
 
             idx += 1
-            offset += len(chunk)
+            offset += length
 
 
-def shard_bytes(data: bytes, shard_size: int) -> List[Shard]:
+def shard_bytes(data: bytes, shard_size: int, elide_zeros: bool = True) -> List[Shard]:
     """Shard an in-memory bytes object."""
     session_id = uuid.uuid4().int >> 64
     total = (len(data) + shard_size - 1) // shard_size
@@ -142,8 +276,11 @@ def shard_bytes(data: bytes, shard_size: int) -> List[Shard]:
 
     for i in range(0, len(data), shard_size):
         chunk = data[i:i + shard_size]
-        shard_hash = xxhash.xxh128(chunk).digest()
-        s = Shard(index=len(shards), offset=i, data=chunk, hash=shard_hash)
+        if elide_zeros and _is_zero(chunk):
+            s = _zero_shard(len(shards), i, len(chunk))
+        else:
+            shard_hash = xxhash.xxh128(chunk).digest()
+            s = Shard(index=len(shards), offset=i, data=chunk, hash=shard_hash)
         s.build_header(session_id, total)
         shards.append(s)
 
@@ -2,52 +2,74 @@
 sndr_snglty.py — Header-aware streaming sender
 for Project Singularity.
 Streams shards from disk instead of preloading.
+Each shard is read and hashed once, then fanned out to every destination
+(star) or to the head of a forwarding chain (see config.FANOUT_*).
 """
 
 import asyncio
-import struct
+import sys
 import time
-from typing import Dict, Tuple
-from shrdng_snglrty import shard_file
-from utils_net import tune_socket
+from typing import List, Optional, Sequence, Tuple
+from shrdng_snglrty import shard_file, pack_route, Hop
+from utils_net import lane_queue_depth, send_on_lane, relay
 import config
 import os
 
-LEN_FMT = "!I"  # uint32 big-endian
-LEN_SIZE = 4
 
+def open_lanes(hops: Sequence[Hop], depth: int) -> Tuple[List[asyncio.Queue], List[asyncio.Task]]:
+    """
+    Start one send_on_lane per port of hops[0]. When more hops follow, each
+    lane opens with a route frame so the receiver forwards it down the chain.
+    """
+    host, ports = hops[0]
+    queues = [asyncio.Queue(maxsize=depth) for _ in ports]
+    if len(hops) > 1:
+        for lane, q in enumerate(queues):
+            q.put_nowait(pack_route(lane, len(ports), hops[1:]))
+    tasks = [asyncio.create_task(send_on_lane(p, q, host)) for p, q in zip(ports, queues)]
+    return queues, tasks
 
-async def send_on_lane(port: int, queue: asyncio.Queue):
-    """Consume packets from a queue and send them over one persistent TCP lane."""
-    reader, writer = await asyncio.open_connection(config.HOST_IP, port)
-    sock = writer.get_extra_info("socket")
-    if sock:
-        tune_socket(sock, getattr(config, "SO_SNDBUF", 0), getattr(config, "SO_RCVBUF", 0))
 
-    pending = 0
-    try:
-        while True:
-            pkt = await queue.get()
-            if pkt is None:  # shutdown sentinel
+class Destination:
+    """Lanes feeding one directly connected receiver (star member or chain head)."""
+
+    def __init__(self, hops: Sequence[Hop], depth: int):
+        self.hops = hops
+        self.queues, self.tasks = open_lanes(hops, depth)
+        self.error: Optional[BaseException] = None
+        self.elapsed = 0.0
+
+    @property
+    def name(self) -> str:
+        host, ports = self.hops[0]
+        return f"{host}:{ports[0]}+{len(ports)}"
+
+    async def put(self, lane: int, item) -> bool:
+        """Feed one lane; on the first dead lane the whole destination is dropped."""
+        if self.error is None and not await relay(self.queues[lane], self.tasks[lane], item):
+            self.fail()
+        return self.error is None
+
+    def fail(self) -> None:
+        errors = [t.exception() for t in self.tasks if t.done() and not t.cancelled()]
+        self.error = next((e for e in errors if e), ConnectionError("lane closed early"))
+        for t in self.tasks:
+            t.cancel()
+
+    async def finish(self, start: float) -> None:
+        """Send end-of-stream on every lane and wait for delivery (or failure)."""
+        for lane in range(len(self.queues)):
+            if not await self.put(lane, None):
                 break
-            writer.write(struct.pack(LEN_FMT, len(pkt)))
-            writer.write(pkt)
-            pending += len(pkt)
-            if pending >= config.DRAIN_BATCH_BYTES:
-                await writer.drain()
-                pending = 0
-        # end-of-stream marker
-        writer.write(struct.pack(LEN_FMT, 0))
-        await writer.drain()
-    finally:
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except Exception:
-            pass
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.error is None:
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                self.error = errors[0]
+        self.elapsed = time.perf_counter() - start
 
 
-async def main():
+async def main() -> int:
     """Shard and stream file shards dynamically through multiple ports."""
     if getattr(config, "USE_UVLOOP", False):
         try:
@@ -59,28 +81,62 @@ async def main():
     total_bytes = os.path.getsize(config.TEST_FILE)
     print(f"[TX] Streaming {total_bytes/1e9:.2f} GB from {config.TEST_FILE}")
 
-    # Create a queue per port (one per lane)
-    queues: Dict[int, asyncio.Queue] = {p: asyncio.Queue(maxsize=8) for p in config.SEND_PORTS}
-    tasks = [asyncio.create_task(send_on_lane(p, q)) for p, q in queues.items()]
+    # Destinations: star feeds each one directly, chain only feeds the head
+    dests: List[Hop] = [(config.HOST_IP, config.SEND_PORTS)]
+    dests += [(h, list(p)) for h, p in getattr(config, "FANOUT_DESTINATIONS", [])]
+    chain = getattr(config, "FANOUT_MODE", "star") == "chain"
+    routes = [dests] if chain else [[d] for d in dests]
+    if len(dests) > 1:
+        print(f"[TX] Fan-out ({'chain' if chain else 'star'}) to "
+              + ", ".join(f"{h}:{p[0]}+{len(p)}" for h, p in dests))
 
-    # Stream shards in real time (memory constant)
-    shard_count = 0
+    # Create a queue per port (one per lane) for every directly fed destination
     start = time.perf_counter()
-    for shard in shard_file(config.TEST_FILE, config.SHARD_SIZE_BYTES):
+    targets = [Destination(hops, lane_queue_depth(len(hops[0][1]), len(routes) > 1))
+               for hops in routes]
+
+    # Stream shards in real time (memory constant); one read + hash feeds all.
+    # A destination whose lanes die is dropped so it cannot stall the others.
+    shard_count = 0
+    zero_count = 0
+    elide = getattr(config, "ELIDE_ZERO_SHARDS", True)
+    for shard in shard_file(config.TEST_FILE, config.SHARD_SIZE_BYTES, elide_zeros=elide):
+        live = [d for d in targets if d.error is None]
+        if not live:
+            break
         pkt = shard.to_bytes()
-        port = config.SEND_PORTS[shard.index % len(config.SEND_PORTS)]
-        await queues[port].put(pkt)
+        for d in live:
+            await d.put(shard.index % len(d.queues), pkt)
         shard_count += 1
+        zero_count += shard.is_zero
 
-    # Signal all lanes to close
-    for q in queues.values():
-        await q.put(None)
-
-    await asyncio.gather(*tasks)
+    # Signal all lanes to close and wait for delivery
+    await asyncio.gather(*(d.finish(start) for d in targets if d.error is None))
     elapsed = time.perf_counter() - start
+
+    failed = [d for d in targets if d.error is not None]
+    if len(targets) > 1:
+        for d in targets:
+            if d.error is None:
+                gbps = (total_bytes * 8 / 1e9) / d.elapsed if d.elapsed > 0 else 0.0
+                print(f"[TX] → {d.name} done in {d.elapsed:.2f}s → {gbps:.2f} Gbps")
+
     gbps = (total_bytes * 8 / 1e9) / elapsed if elapsed > 0 else 0.0
-    print(f"[TX] Sent {total_bytes/1e9:.2f} GB ({shard_count} shards) in {elapsed:.2f}s → {gbps:.2f} Gbps")
+    replicas = ""
+    if len(dests) > 1:
+        replicas = f" into a {len(dests)}-hop chain" if chain else f" to {len(dests)} destinations"
+    if failed:
+        errors = ", ".join(f"{d.name} ({type(d.error).__name__}: {d.error})" for d in failed)
+        if chain:
+            # A hop whose forward fails resets its upstream lanes, so any
+            # failure along the chain surfaces here on the head's lanes
+            replicas += f"; FAILED at or after {errors}"
+        else:
+            replicas = f" to {len(targets) - len(failed)}/{len(targets)} destinations; FAILED {errors}"
+    print(f"[TX] Sent {total_bytes/1e9:.2f} GB ({shard_count} shards, {zero_count} zero-elided){replicas} "
+          f"in {elapsed:.2f}s → {gbps:.2f} Gbps")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main()))
@@ -1,37 +1,89 @@
 """
 snglty_recv.py — Header-aware multi-lane receiver
 for Project Singularity.
+Writes shards at their header offset; zero-elided shards are left as holes.
+Lanes that open with a route frame are forwarded to the next chain hop.
 """
 
 import asyncio
+import os
 import struct
 import sys
-from typing import Dict, Set, Tuple
-from utils_net import tune_socket
-from shrdng_snglrty import unpack_header, HEADER_SIZE
+from typing import Dict, List, Optional, Set, Tuple
+from utils_net import tune_socket, lane_queue_depth, send_on_lane, relay
+from shrdng_snglrty import (unpack_header, pack_route, unpack_route, Hop,
+                            HEADER_SIZE, FLAG_ZERO, FLAG_ROUTE)
 import config
 
 LEN_FMT = "!I"  # uint32 big-endian frame prefix
 LEN_SIZE = struct.calcsize(LEN_FMT)
 
 total_bytes = 0
+elided_bytes = 0
 active_clients: Set[asyncio.Task] = set()
 
 # Optional in-memory session tracker
 sessions: Dict[int, Dict[int, bytes]] = {}
 
+# Shared output file (positioned writes from every lane)
+out_fd: Optional[int] = None
+out_size = 0  # highest end offset dispatched so far
+out_session: Optional[int] = None  # session currently being reassembled
+
+
+def open_output(path: str) -> int:
+    """Open (and truncate) the reassembly target shared by all lanes."""
+    return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+
+def begin_session(session_id: int) -> None:
+    """
+    Reset the output when a new transfer starts, so zero-elided ranges and
+    the tail past the new file's end never keep bytes from an earlier one.
+    Runs on the event loop, before any write of the new session is dispatched.
+    """
+    global out_session, out_size
+    if out_fd is not None and session_id != out_session:
+        os.ftruncate(out_fd, 0)
+        out_size = 0
+        out_session = session_id
+
+
+def extend_output(end: int) -> None:
+    """
+    Grow the output to `end` without writing, leaving a hole. Runs on the
+    event loop so extensions are ordered with respect to dispatched writes.
+    """
+    global out_size
+    if out_fd is not None and end > out_size:
+        os.ftruncate(out_fd, end)
+        out_size = end
+
+
+def forward_lane(lane: int, lanes: int, hops: List[Hop]) -> Tuple[asyncio.Queue, asyncio.Task]:
+    """
+    Open this lane's counterpart on the next hop, passing on the rest of the
+    route. All `lanes` incoming lanes forward, so they split the buffer budget.
+    """
+    host, ports = hops[0]
+    queue: asyncio.Queue = asyncio.Queue(maxsize=lane_queue_depth(lanes, fanout=True))
+    if len(hops) > 1:
+        queue.put_nowait(pack_route(lane, lanes, hops[1:]))
+    task = asyncio.create_task(send_on_lane(ports[lane % len(ports)], queue, host))
+    return queue, task
+
 
 async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
     """Handle one TCP connection and extract [HEADER][DATA] frames."""
-    global total_bytes
+    global total_bytes, elided_bytes, out_size
 
     sock = writer.get_extra_info("socket")
     if sock:
         tune_socket(sock, getattr(config, "SO_SNDBUF", 0), getattr(config, "SO_RCVBUF", 0))
 
-    f = None
-    if getattr(config, "RECEIVER_WRITE_TO_DISK", False):
-        f = await asyncio.to_thread(open, config.OUTPUT_PATH, "ab", buffering=0)
+    # Chain replication: bounded queue + lane toward the next hop
+    fwd_queue: Optional[asyncio.Queue] = None
+    fwd_task: Optional[asyncio.Task] = None
 
     try:
         while True:
@@ -49,11 +101,31 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
 
             header = unpack_header(packet[:HEADER_SIZE])
             payload = packet[HEADER_SIZE:]
-            total_bytes += len(payload)
+            end = header["offset"] + header["data_length"]
+
+            if header["flags"] & FLAG_ROUTE:
+                lane, lanes, hops = unpack_route(payload)
+                if hops and fwd_task is None:
+                    fwd_queue, fwd_task = forward_lane(lane, lanes, hops)
+                continue
 
-            # Optional disk write
-            if f:
-                await asyncio.to_thread(f.write, payload)
+            if fwd_queue is not None:
+                # Relay before local work; the queue bounds how far the next hop may lag
+                if not await relay(fwd_queue, fwd_task, packet):
+                    fwd_queue = None  # next hop gone; keep receiving locally
+
+            begin_session(header["session_id"])
+
+            if header["flags"] & FLAG_ZERO:
+                # Header-only frame: nothing to write, just leave a hole
+                elided_bytes += header["data_length"]
+                extend_output(end)
+            else:
+                total_bytes += len(payload)
+                # Optional disk write
+                if out_fd is not None:
+                    out_size = max(out_size, end)
+                    await asyncio.to_thread(os.pwrite, out_fd, payload, header["offset"])
 
             # Track per-session shards (for debugging or future reassembly)
             sid = header["session_id"]
@@ -64,9 +136,23 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
     except asyncio.IncompleteReadError:
         pass  # client closed early
     finally:
-        if f:
-            await asyncio.to_thread(f.close)
+        # Close the downstream lane first so our upstream only sees EOF once
+        # the whole rest of the chain has the data
+        fwd_error: Optional[str] = None
+        if fwd_task is not None:
+            if fwd_queue is not None:
+                await relay(fwd_queue, fwd_task, None)
+            try:
+                await fwd_task
+            except Exception as e:
+                fwd_error = str(e) or type(e).__name__
+                print(f"[RX] Forwarding to next hop failed: {fwd_error}", flush=True)
         try:
+            if fwd_error:
+                # Status frame back up the lane: the upstream's send_on_lane
+                # raises it, so the failure climbs the chain to the sender
+                msg = fwd_error.encode()
+                writer.write(struct.pack(LEN_FMT, len(msg)) + msg)
             writer.close()
             await writer.wait_closed()
         except Exception:
@@ -74,8 +160,12 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
 
 
 async def start_servers():
+    global out_fd
+    if getattr(config, "RECEIVER_WRITE_TO_DISK", False):
+        out_fd = open_output(config.OUTPUT_PATH)
+
     servers = []
-    for port in config.SEND_PORTS:
+    for port in (p + config.RECV_PORT_OFFSET for p in config.RECV_PORT):
         srv = await asyncio.start_server(handle_client, host=config.HOST_IP, port=port, reuse_port=False)
         servers.append(srv)
         for sock in srv.sockets or []:
@@ -102,7 +192,10 @@ def main():
     except KeyboardInterrupt:
         pass
     finally:
-        print(f"[RX] Total received: {total_bytes/1e9:.2f} GB", flush=True)
+        if out_fd is not None:
+            os.close(out_fd)
+        print(f"[RX] Total received: {total_bytes/1e9:.2f} GB "
+              f"(+{elided_bytes/1e9:.2f} GB zero-elided)", flush=True)
 
 
 if __name__ == "__main__":
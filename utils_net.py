@@ -1,5 +1,12 @@
-# utils_net.py — tiny socket helpers
+# utils_net.py — tiny socket helpers + the lane plumbing shared by sender and receiver
+import asyncio
 import socket
+import struct
+from typing import Optional
+import config
+
+LEN_FMT = "!I"  # uint32 big-endian frame prefix
+
 
 def tune_socket(sock, sndbuf: int, rcvbuf: int):
     try:
@@ -9,3 +16,68 @@ def tune_socket(sock, sndbuf: int, rcvbuf: int):
     except Exception:
         # Tuning is best-effort; do not crash if a platform refuses it.
         pass
+
+
+def lane_queue_depth(n_lanes: int, fanout: bool) -> int:
+    """
+    Shards buffered per lane. With several destinations the queues are the
+    bound on how far a slow destination may lag before it throttles the read.
+    """
+    if not fanout:
+        return 8
+    budget = getattr(config, "FANOUT_BUFFER_BYTES", 0) // (config.SHARD_SIZE_BYTES * n_lanes)
+    return max(8, budget)
+
+
+async def send_on_lane(port: int, queue: asyncio.Queue, host: Optional[str] = None):
+    """Consume packets from a queue and send them over one persistent TCP lane."""
+    reader, writer = await asyncio.open_connection(host or config.HOST_IP, port)
+    sock = writer.get_extra_info("socket")
+    if sock:
+        tune_socket(sock, getattr(config, "SO_SNDBUF", 0), getattr(config, "SO_RCVBUF", 0))
+
+    pending = 0
+    try:
+        while True:
+            pkt = await queue.get()
+            if pkt is None:  # shutdown sentinel
+                break
+            if writer.is_closing():  # peer gone; fail now rather than write into the void
+                raise ConnectionResetError("Connection lost")
+            writer.write(struct.pack(LEN_FMT, len(pkt)))
+            writer.write(pkt)
+            pending += len(pkt)
+            if pending >= config.DRAIN_BATCH_BYTES:
+                await writer.drain()
+                pending = 0
+        # end-of-stream marker
+        writer.write(struct.pack(LEN_FMT, 0))
+        await writer.drain()
+        # Wait for the receiver to close its side so timings cover delivery,
+        # not just handing bytes to a local buffer (or the WAN proxy).
+        # Anything sent back first is a status frame: a chain hop that
+        # could not forward the lane, with the reason
+        status = await reader.read()
+        if status:
+            raise ConnectionError(status[struct.calcsize(LEN_FMT):].decode(errors="replace"))
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def relay(queue: asyncio.Queue, task: asyncio.Task, item) -> bool:
+    """Queue `item` for a lane; False if that lane died (never block on a dead lane)."""
+    if task.done():
+        return False
+    if not queue.full():
+        queue.put_nowait(item)
+        return True
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, task}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        return False
+    return True
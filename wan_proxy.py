@@ -0,0 +1,393 @@
+"""
+wan_proxy.py — Userspace WAN impairment proxy
+for Project Singularity.
+Sits between sender lanes and receiver ports on one host and injects
+latency, jitter, bandwidth caps and loss without root or `tc netem`.
+
+    sender → HOST_IP:SEND_PORTS → [proxy] → HOST_IP:RECV_PORT+offset → receiver
+
+TCP lanes are terminated locally, so loss cannot drop real segments.
+Instead each lane is paced the way a TCP flow over the emulated path
+would be:
+  - a shared bottleneck link (the profile's bandwidth_mbps) serialises all lanes,
+  - each lane is capped at its own bandwidth_mbps and at the Mathis
+    steady-state rate MSS / RTT * 1.22 / sqrt(loss),
+  - each lane has at most `window_bytes` un-ACKed in flight, released one
+    RTT after the data is forwarded (window / RTT ceiling),
+  - delivery is delayed by the one-way delay plus jitter, in order.
+UDP datagrams are dropped, delayed and reordered for real.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import sys
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple
+from utils_net import tune_socket
+import config
+
+CHUNK = 64 * 1024  # bytes read per TCP pump step
+MSS = 1448         # typical Ethernet TCP payload
+
+# ===============================================================
+# Impairment profiles
+# ===============================================================
+
+@dataclass
+class Impairment:
+    delay_ms: float = 0.0          # one-way delay (RTT = 2x)
+    jitter_ms: float = 0.0         # stdev of per-chunk / per-datagram delay
+    loss: float = 0.0              # packet loss fraction (0.001 = 0.1%)
+    bandwidth_mbps: float = 0.0    # profile: shared bottleneck; lane override: lane cap; 0 = unlimited
+    window_bytes: int = config.SO_RCVBUF  # per-lane in-flight ceiling
+
+    @property
+    def rtt(self) -> float:
+        return 2 * self.delay_ms / 1e3
+
+    def bandwidth(self) -> float:
+        """Bandwidth cap in bytes/s, inf if unlimited."""
+        return self.bandwidth_mbps * 1e6 / 8 if self.bandwidth_mbps > 0 else math.inf
+
+    def lane_rate(self) -> float:
+        """Steady-state TCP rate (bytes/s) for one lane, inf if unbounded."""
+        if self.loss > 0 and self.rtt > 0:
+            return MSS / self.rtt * 1.22 / math.sqrt(self.loss)
+        return math.inf
+
+    def sample_delay(self) -> float:
+        """One-way delay in seconds with gaussian jitter, never negative."""
+        d = self.delay_ms
+        if self.jitter_ms:
+            d = random.gauss(d, self.jitter_ms)
+        return max(0.0, d / 1e3)
+
+
+# Named profiles; "lanes" maps lane index → per-lane field overrides.
+WAN_PROFILES: Dict[str, dict] = {
+    "loopback": {},
+    "metro":    {"delay_ms": 2.5, "jitter_ms": 0.5, "bandwidth_mbps": 10_000},
+    "wan50":    {"delay_ms": 25, "jitter_ms": 2, "loss": 0.001, "bandwidth_mbps": 1_000},
+    "transpac": {"delay_ms": 75, "jitter_ms": 5, "loss": 0.0005, "bandwidth_mbps": 1_000},
+    "lossy":    {"delay_ms": 40, "jitter_ms": 10, "loss": 0.01, "bandwidth_mbps": 200},
+    "wan50-badlane": {
+        "delay_ms": 25, "jitter_ms": 2, "loss": 0.001, "bandwidth_mbps": 1_000,
+        "lanes": {0: {"loss": 0.02, "jitter_ms": 15}},
+    },
+}
+
+
+def load_profile(name: str, n_lanes: int, **overrides) -> Tuple[Impairment, List[Impairment]]:
+    """
+    Expand a named profile into its base Impairment (which sizes the shared
+    link) and one Impairment per lane.
+    """
+    if name not in WAN_PROFILES:
+        raise SystemExit(f"[PROXY] Unknown profile {name!r}; choose from {', '.join(WAN_PROFILES)}")
+    spec = dict(WAN_PROFILES[name])
+    per_lane = spec.pop("lanes", {})
+    base = Impairment(**spec)
+    base = replace(base, **{k: v for k, v in overrides.items() if v is not None})
+    return base, [replace(base, **per_lane.get(i, {})) for i in range(n_lanes)]
+
+
+# ===============================================================
+# Link model
+# ===============================================================
+
+class Link:
+    """Serialises bytes at a fixed rate: the shared bottleneck, or one lane's cap."""
+
+    def __init__(self, rate: float):
+        self.rate = rate  # bytes/s, inf = unlimited
+        self.free_at = 0.0
+
+    def book(self, n: int, now: float) -> float:
+        """Reserve the link for `n` bytes; return when they have left it."""
+        self.free_at = max(now, self.free_at) + n / self.rate
+        return self.free_at
+
+    def backlog(self, now: float) -> float:
+        return max(0.0, self.free_at - now)
+
+
+class Pacer:
+    """
+    Per-lane, per-direction pacing on top of the shared link. The lane runs
+    at the lower of its own bandwidth cap and its Mathis rate.
+    """
+
+    def __init__(self, imp: Impairment, link: Link):
+        self.imp = imp
+        self.link = link
+        self.lane = Link(min(imp.lane_rate(), imp.bandwidth()))
+        self.last_delivery = 0.0
+
+    def schedule(self, n: int, now: float) -> float:
+        """Return the loop time at which `n` bytes reach the far side (in order)."""
+        # Lane and shared link are booked independently so one slow lane's
+        # future schedule never holds the link against the other lanes
+        depart = max(self.lane.book(n, now), self.link.book(n, now))
+        self.last_delivery = max(self.last_delivery, depart + self.imp.sample_delay())
+        return self.last_delivery
+
+
+# ===============================================================
+# TCP lanes
+# ===============================================================
+
+class Window:
+    """Bytes in flight (forwarded but not yet ACKed) for one lane direction."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.used = 0
+        self._opened = asyncio.Event()
+
+    async def room(self) -> int:
+        """Wait until the window is not full; return how many bytes may be sent."""
+        while self.used >= self.size:
+            self._opened.clear()
+            await self._opened.wait()
+        return self.size - self.used
+
+    def take(self, n: int) -> None:
+        self.used += n
+
+    def release(self, n: int) -> None:
+        self.used -= n
+        self._opened.set()
+
+
+async def _pump(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pacer: Pacer):
+    """Forward one direction of a lane with pacing, delay and a bounded window."""
+    loop = asyncio.get_running_loop()
+    window = Window(pacer.imp.window_bytes)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def ingress():
+        while True:
+            data = await reader.read(min(CHUNK, await window.room()))
+            if not data:
+                await queue.put(None)
+                return
+            window.take(len(data))
+            await queue.put((pacer.schedule(len(data), loop.time()), data))
+
+    async def egress():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            deliver_at, data = item
+            wait = deliver_at - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            writer.write(data)
+            await writer.drain()
+            # The ACK needs another one-way delay to come back; only then
+            # does the window reopen, giving the window / RTT ceiling
+            loop.call_at(deliver_at + pacer.imp.delay_ms / 1e3, window.release, len(data))
+        if writer.can_write_eof():
+            writer.write_eof()
+
+    # If either side fails (e.g. reset), stop the other instead of leaving it
+    # parked on the window or the queue
+    tasks = [asyncio.create_task(ingress()), asyncio.create_task(egress())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in done:
+            t.result()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class TcpLane:
+    def __init__(self, listen_port: int, target_port: int, imp: Impairment,
+                 up: Link, down: Link):
+        self.listen_port = listen_port
+        self.target_port = target_port
+        self.imp = imp
+        self.up = up
+        self.down = down
+
+    async def handle(self, c_reader: asyncio.StreamReader, c_writer: asyncio.StreamWriter):
+        try:
+            u_reader, u_writer = await asyncio.open_connection(config.HOST_IP, self.target_port)
+        except OSError as e:
+            print(f"[PROXY] :{self.listen_port} upstream :{self.target_port} refused: {e}", flush=True)
+            c_writer.close()
+            return
+        for w in (c_writer, u_writer):
+            sock = w.get_extra_info("socket")
+            if sock:
+                tune_socket(sock, getattr(config, "SO_SNDBUF", 0), getattr(config, "SO_RCVBUF", 0))
+        try:
+            await asyncio.gather(
+                _pump(c_reader, u_writer, Pacer(self.imp, self.down)),
+                _pump(u_reader, c_writer, Pacer(self.imp, self.up)),
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for w in (c_writer, u_writer):
+                try:
+                    w.close()
+                    await w.wait_closed()
+                except Exception:
+                    pass
+
+    async def start(self):
+        return await asyncio.start_server(self.handle, host=config.HOST_IP, port=self.listen_port)
+
+
+# ===============================================================
+# UDP lanes
+# ===============================================================
+
+class _UdpUpstream(asyncio.DatagramProtocol):
+    """Connected socket toward the receiver for one client address."""
+
+    def __init__(self, lane: "UdpLane", client: Tuple[str, int]):
+        self.lane = lane
+        self.client = client
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: List[bytes] = []  # due before the socket was connected
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending.clear()
+
+    def send(self, data: bytes) -> None:
+        if self.transport:
+            self.transport.sendto(data)
+        else:
+            self.pending.append(data)
+
+    def reply(self, data: bytes) -> None:
+        self.lane.reply(data, self.client)
+
+    def datagram_received(self, data, addr):
+        self.lane.impair(data, self.lane.up_lane, self.lane.up, self.reply)
+
+
+class UdpLane(asyncio.DatagramProtocol):
+    """Datagram forwarder with real drop, tail-drop, delay and reordering."""
+
+    def __init__(self, listen_port: int, target_port: int, imp: Impairment,
+                 up: Link, down: Link):
+        self.listen_port = listen_port
+        self.target_port = target_port
+        self.imp = imp
+        self.up = up
+        self.down = down
+        self.up_lane = Link(imp.bandwidth())
+        self.down_lane = Link(imp.bandwidth())
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.upstreams: Dict[Tuple[str, int], _UdpUpstream] = {}
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def reply(self, data: bytes, client: Tuple[str, int]) -> None:
+        if self.transport:
+            self.transport.sendto(data, client)
+
+    def impair(self, data: bytes, lane: Link, link: Link, deliver) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Random loss, then tail-drop once either queue exceeds a window
+        queued = max((l.backlog(now) * l.rate if l.rate != math.inf else 0) for l in (lane, link))
+        if random.random() < self.imp.loss or queued > self.imp.window_bytes:
+            self.dropped += 1
+            return
+        depart = max(lane.book(len(data), now), link.book(len(data), now))
+        loop.call_at(depart + self.imp.sample_delay(), deliver, data)
+
+    def datagram_received(self, data, addr):
+        up = self.upstreams.get(addr)
+        if up is None:
+            up = _UdpUpstream(self, addr)
+            self.upstreams[addr] = up
+            loop = asyncio.get_running_loop()
+            loop.create_task(loop.create_datagram_endpoint(
+                lambda: up, remote_addr=(config.HOST_IP, self.target_port)))
+        self.impair(data, self.down_lane, self.down, up.send)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: self, local_addr=(config.HOST_IP, self.listen_port))
+        return transport
+
+
+# ===============================================================
+# Entrypoint
+# ===============================================================
+
+async def run_proxy(base: Impairment, lanes_imp: List[Impairment], offset: int, udp: bool = False):
+    # One shared bottleneck per direction across all lanes, sized by the profile
+    down = Link(base.bandwidth())
+    up = Link(base.bandwidth())
+
+    handles = []
+    for i, (listen, target) in enumerate(zip(config.SEND_PORTS, config.RECV_PORT)):
+        imp = lanes_imp[i]
+        tcp = TcpLane(listen, target + offset, imp, up, down)
+        handles.append(await tcp.start())
+        if udp:
+            handles.append(await UdpLane(listen, target + offset, imp, up, down).start())
+        print(f"[PROXY] {config.HOST_IP}:{listen} → :{target + offset}  "
+              f"delay={imp.delay_ms}ms jitter={imp.jitter_ms}ms loss={imp.loss:.4%} "
+              f"bw={imp.bandwidth_mbps or '∞'}Mbps", flush=True)
+
+    print("[PROXY_READY]", flush=True)
+
+    servers = [h for h in handles if isinstance(h, asyncio.AbstractServer)]
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for srv in servers:
+                tg.create_task(srv.serve_forever())
+            if not servers:
+                tg.create_task(asyncio.Event().wait())
+    finally:
+        for h in handles:
+            h.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Userspace WAN impairment proxy")
+    ap.add_argument("--profile", default="wan50", help=f"one of: {', '.join(WAN_PROFILES)}")
+    ap.add_argument("--offset", type=int, default=config.WAN_PROXY_PORT_OFFSET,
+                    help="receiver listens on RECV_PORT + offset")
+    ap.add_argument("--udp", action="store_true", help="also forward UDP on the same ports")
+    ap.add_argument("--delay-ms", type=float)
+    ap.add_argument("--jitter-ms", type=float)
+    ap.add_argument("--loss", type=float)
+    ap.add_argument("--bandwidth-mbps", type=float)
+    ap.add_argument("--window-bytes", type=int)
+    args = ap.parse_args()
+
+    if args.offset == 0 and config.SEND_PORTS == config.RECV_PORT:
+        sys.exit("[PROXY] --offset must be non-zero when sender and receiver share ports")
+
+    base, lanes_imp = load_profile(
+        args.profile, len(config.SEND_PORTS),
+        delay_ms=args.delay_ms, jitter_ms=args.jitter_ms, loss=args.loss,
+        bandwidth_mbps=args.bandwidth_mbps, window_bytes=args.window_bytes,
+    )
+    try:
+        asyncio.run(run_proxy(base, lanes_imp, args.offset, udp=args.udp))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()